@@ -0,0 +1,102 @@
+""" Screen capture throughput through the whole host side stack
+
+A fake transport plays a device answering every exec:screencap with a raw RGBA frame, so this measures
+py_adb itself: packet parsing, routing, OKAYs and landing pixels into pooled frames.
+Usage: PYTHONPATH=. python benchmarks/capture_throughput.py [frames] [max_packet_size]
+"""
+
+import sys
+import time
+import struct
+import threading
+import collections
+
+from py_adb.handle import HandlerFactory
+from py_adb.adb_commands import AdbSessionManager, AdbUsbClient
+from py_adb.capture import ScreenCapture
+from py_adb.common.packager import MessagePackager
+from py_adb.usb_exceptions import ReadFailedError
+
+WIDTH, HEIGHT = 1080, 2400
+DEVICE_VERSION = AdbUsbClient.VERSION
+
+
+class FakeUsbError(Exception):
+    value = -7  # LIBUSB_ERROR_TIMEOUT
+
+
+class FakeDeviceHandler(object):
+    """ Answers CNXN and serves screencap output, read units are exactly what client asks for """
+    def __init__(self, source):
+        self.packager = MessagePackager()
+        self.frame = memoryview(struct.pack('<4I', WIDTH, HEIGHT, 1, 0) + b'\x7f' * (WIDTH * HEIGHT * 4))
+        self.max_packet_size = 4096
+        self.pieces = collections.deque()
+        self.available = threading.Condition()
+        self.header = None
+        self.remote_ids = iter(range(1000, 1 << 31))
+
+    def emit(self, tag, arg0, arg1, data=b''):
+        checksum = self.packager.checksum(data) if DEVICE_VERSION < AdbUsbClient.VERSION_SKIP_CHECKSUM else 0
+        header = struct.pack(
+            '<6I', self.packager.get_id_for_tag(tag), arg0, arg1, len(data), checksum,
+            self.packager.get_id_for_tag(tag) ^ 0xFFFFFFFF
+        )
+        with self.available:
+            self.pieces.append(header)
+            if data:
+                self.pieces.append(data)
+            self.available.notify()
+
+    def write(self, data):
+        if self.header is None:
+            self.header = self.packager.unpack_header(bytes(data))
+            return
+        header, self.header = self.header, None
+        if header['tag'] == b'CNXN':
+            self.max_packet_size = header['arg1']
+            self.emit(b'CNXN', DEVICE_VERSION, self.max_packet_size, b'device::fake\0')
+        elif header['tag'] == b'OPEN':
+            local_id, remote_id = header['arg0'], next(self.remote_ids)
+            self.emit(b'OKAY', remote_id, local_id)
+            for start in range(0, len(self.frame), self.max_packet_size):
+                # bytes() copy stands for the copy libusb1 makes out of its transfer buffer
+                self.emit(b'WRTE', remote_id, local_id, bytes(self.frame[start:start + self.max_packet_size]))
+            self.emit(b'CLSE', remote_id, local_id)
+
+    def read(self, length):
+        with self.available:
+            if not self.pieces and not self.available.wait(1):
+                raise ReadFailedError('Fake read timed out', FakeUsbError())
+            return self.pieces.popleft()
+
+    def close(self):
+        pass
+
+
+def measure(frames, max_packet_size):
+    manager = AdbSessionManager('fake:', max_packet_size=max_packet_size)
+    capture = ScreenCapture(manager)
+    capture.release(capture.grab())
+    stream = capture.stream(depth=2)
+    start = time.perf_counter()
+    for _, frame in zip(range(frames), stream):
+        pass
+    elapsed = time.perf_counter() - start
+    stream.close()
+    return frames / elapsed
+
+
+def main():
+    global DEVICE_VERSION
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    max_packet_size = int(sys.argv[2]) if len(sys.argv) > 2 else 256 * 1024
+    HandlerFactory.register_handler('fake', 'fake:', __name__, 'FakeDeviceHandler')
+    print('%sx%s RGBA frames, max_packet_size %s' % (WIDTH, HEIGHT, max_packet_size))
+    for name, version in [('skip checksum', AdbUsbClient.VERSION_SKIP_CHECKSUM), ('checksum', 0x01000000)]:
+        DEVICE_VERSION = version
+        print('%-14s %8.1f fps' % (name, measure(frames, max_packet_size)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+""" Import time of py_adb core modules
+
+Every module is imported in a fresh interpreter, so nothing is cached between runs.
+Usage: python benchmarks/import_time.py [runs]
+"""
+
+import sys
+import subprocess
+
+MODULES = ['py_adb.adb_commands', 'py_adb.common.packager', 'py_adb.handle']
+# must not be pulled in until a transport is actually used
+HEAVY_MODULES = ['usb1', 'libusb1', 'netort', 'socket']
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print('%.6f %s' % (elapsed, ','.join(m for m in {heavy!r} if m in sys.modules)))
+'''
+
+
+def measure(module, runs):
+    timings, loaded = [], ''
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, '-c', SCRIPT.format(module=module, heavy=HEAVY_MODULES)]
+        ).decode().split()
+        timings.append(float(output[0]))
+        loaded = output[1] if len(output) > 1 else ''
+    return min(timings), sorted(timings)[len(timings) // 2], loaded
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    print('%-28s %10s %10s  %s' % ('module', 'best, ms', 'median, ms', 'heavy modules loaded'))
+    for module in MODULES:
+        best, median, loaded = measure(module, runs)
+        print('%-28s %10.2f %10.2f  %s' % (module, best * 1000, median * 1000, loaded or '-'))
+
+
+if __name__ == '__main__':
+    main()
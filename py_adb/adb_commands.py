@@ -2,45 +2,70 @@
 Inspired by https://github.com/google/python-adb
 """
 
-import socket
 import logging
+import threading
+import itertools
 import queue as q
-import usb1
 
 from py_adb.adb_exceptions import InvalidResponseError
-from py_adb.usb_exceptions import DeviceAuthError, ReadFailedError
+from py_adb.usb_exceptions import DeviceAuthError, ReadFailedError, LibusbWrappingError, CommonUsbError
 from py_adb.common.interfaces import AdbClient
 from py_adb.common.packager import MessagePackager
 from py_adb.handle import HandlerFactory
 
-from netort.data_processing import Drain, get_nowait_from_queue
-
 logger = logging.getLogger(__name__)
 
+LIBUSB_ERROR_IO = -1
+LIBUSB_ERROR_TIMEOUT = -7
+
+
+def get_nowait_from_queue(queue):
+    """ Everything that is in the queue right now, without blocking """
+    data = []
+    for _ in range(queue.qsize()):
+        try:
+            data.append(queue.get_nowait())
+        except q.Empty:
+            break
+    return data
 
-class IncomingRouter(object):
+
+class IncomingRouter(threading.Thread):
+    """ Reads incoming messages and routes them to sessions """
     def __init__(self, client, sessions, pending_data):
+        super(IncomingRouter, self).__init__(name='adb-router')
+        self.daemon = True
         self.client = client
         self.sessions = sessions
         self.pending_data = pending_data
 
-    def __iter__(self):
+    def run(self):
         while True:
             try:
-                message = self.client.read()
+                message = self.client.read(allow_idle=True)
                 if message:
                     remote_id = message['arg0']
                     local_id = message['arg1']
+                    session = self.sessions.get(local_id)
+                    if not session:
+                        # late packets for a session already closed on our side
+                        continue
                     if message['tag'] == b'OKAY':
-                        self.sessions[local_id].register(remote_id)
+                        session.register(remote_id)
                     elif message['tag'] == b'WRTE':
-                        self.sessions[local_id].put(message['data'])
-            except usb1.USBErrorIO:
-                logger.warning('Something nasty happened. '
-                               'Probably you are trying to send more data than USB buffer can handle.')
-                self.client.close_handler()
-                raise
-            except usb1.USBError:
+                        session.put(message['data'])
+                        if session.finished:
+                            # consumer failed and session closed itself
+                            self.sessions.pop(local_id, None)
+                    elif message['tag'] == b'CLSE':
+                        self.sessions.pop(local_id, None)
+                        session.finish()
+            except LibusbWrappingError as e:
+                if e.usb_error.value == LIBUSB_ERROR_IO:
+                    logger.warning('Something nasty happened. '
+                                   'Probably you are trying to send more data than USB buffer can handle.')
+                    self.client.close_handler()
+                    raise
                 logger.error('USB device error', exc_info=True)
                 raise
             except Exception:
@@ -50,48 +75,63 @@ class IncomingRouter(object):
 
 class AdbSessionManager(object):
     """ Device session manager """
-    def __init__(self, source, rsa_keys=None, timeout=10000):
+    def __init__(self, source, rsa_keys=None, timeout=10000, max_packet_size=4096):
         self.source = source
         self.rsa_keys = rsa_keys
         self.timeout = timeout
+        self.max_packet_size = max_packet_size
         self.connected = False
         self.client = None
         self.sessions = {}
         self.pending_data = {}
-        self.in_messages = q.Queue()
-        self.in_messages_drain = None
         self.router = None
+        self.local_ids = itertools.count(1)
+
+    def open_session(self, command, consumer=None):
+        """Opens new session for command.
 
-    def open_session(self, command):
+        If consumer is given, its feed(data) is called from the router thread for every incoming chunk
+        and finish() when device closes the session, instead of queueing data for get().
+        """
+        if self.router and not self.router.is_alive():
+            raise RuntimeError('Message router for %s has stopped, reconnect to the device' % self.source)
         if not self.connected:
             try:
                 logger.debug('Establishing connection')
-                self.client = AdbUsbClient(self.source, self.rsa_keys)
+                self.client = AdbUsbClient(self.source, self.rsa_keys, max_packet_size=self.max_packet_size)
                 connected = self.client.connect()
                 logger.info('Connected: %s', connected)
                 self.connected = True
-            except usb1.USBError:
+            except CommonUsbError:
                 logger.error('USB error trying to establish connection to the phone', exc_info=True)
-                self.client.close_handler()
+                if self.client:
+                    self.client.close_handler()
                 raise
         if not self.router:
             self.start_processing()
 
-        local_id = len(self.sessions)+1
-        self.sessions[local_id] = AdbSession(local_id, self.client, command)
+        # ids are never reused, finished and closed sessions are dropped
+        local_id = next(self.local_ids)
+        session = AdbSession(local_id, self.client, command, consumer)
+        # register session before OPEN goes out, so router always finds it when device replies
+        self.sessions[local_id] = session
+        session.open()
 
-        return self.sessions[local_id]
+        return session
 
     def start_processing(self):
         self.router = IncomingRouter(self.client, self.sessions, self.pending_data)
-        self.in_messages_drain = Drain(self.router, self.in_messages)
-        self.in_messages_drain.start()
+        self.router.start()
 
     def close_session(self, local_id):
+        """ Closes session on our side, it is finished right away and gets no more data """
         if not self.check_if_session_and_connection_exists(local_id):
             return
         else:
-            self.sessions[local_id].close()
+            session = self.sessions.pop(local_id, None)
+            if session:
+                session.close()
+                session.finish()
 
     def check_if_session_and_connection_exists(self, local_id):
         if not self.connected or not self.sessions:
@@ -99,29 +139,24 @@ class AdbSessionManager(object):
                 'Device not connected or no active sessions found! I\'m not a teapot! Open session first', exc_info=True
             )
             return
-        if not self.sessions[local_id]:
+        if not self.sessions.get(local_id):
             logger.warning('Session %s not found', local_id)
             return
         return True
 
 
 class AdbSession(object):
-    def __init__(self, local_id, client, command):
+    def __init__(self, local_id, client, command, consumer=None):
         self.incoming_session_data = q.Queue()
         self.local_id = local_id
         self.remote_id = None
         self.client = client
-        self.client.open(local_id, command)
+        self.command = command
+        self.consumer = consumer
         self.finished = False
 
-    def send_okay(self):
-        logger.debug('Sending OKAY for successfull write')
-        msg = dict(
-            tag=b'OKAY',
-            arg0=self.local_id,
-            arg1=self.remote_id
-        )
-        self.client.send(msg)
+    def open(self):
+        self.client.open(self.local_id, self.command)
 
     def register(self, remote_id):
         if not self.remote_id:
@@ -132,19 +167,37 @@ class AdbSession(object):
 
     def get(self):
         while True:
+            finished = self.finished
             yield get_nowait_from_queue(self.incoming_session_data)
-            if self.finished:
+            if finished:
                 break
 
     def put(self, data):
-        self.incoming_session_data.put(data)
-        self.send_okay()
+        # OKAY for this write has already been sent by client.read()
+        if self.consumer:
+            # consumer runs in router thread, its errors must not stop other sessions
+            try:
+                self.consumer.feed(memoryview(data))
+            except Exception:
+                logger.error('Session %s consumer failed, closing session', self.local_id, exc_info=True)
+                self.close()
+                self.finish()
+        else:
+            self.incoming_session_data.put(data)
+
+    def finish(self):
+        self.finished = True
+        if self.consumer:
+            try:
+                self.consumer.finish()
+            except Exception:
+                logger.error('Session %s consumer failed to finish', self.local_id, exc_info=True)
 
     def close(self):
         msg = dict(
             tag=b'CLSE',
             arg0=self.local_id,
-            arg1=self.remote_id
+            arg1=self.remote_id or 0  # device may not have confirmed OPEN yet
         )
         self.client.send(msg)
 
@@ -155,21 +208,33 @@ class AdbSession(object):
 class AdbUsbClient(AdbClient):
     """ Device client """
 
-    VERSION = 0x01000000  # ADB protocol version.
+    VERSION = 0x01000001  # ADB protocol version.
+    VERSION_SKIP_CHECKSUM = 0x01000001  # Since this version data checksums are 0 and must not be verified.
+
+    # Process-wide {source: public key} of the keys devices accepted last time, tried first on reconnect
+    accepted_keys = {}
+    accepted_keys_lock = threading.Lock()
 
-    def __init__(self, source, rsa_keys, timeout=10000):
+    def __init__(self, source, rsa_keys, timeout=10000, max_packet_size=4096):
+        self.source = source
         self.timeout = timeout
         self.usb_handler = HandlerFactory().get_handler(source)
         self.rsa_keys = rsa_keys
         self.packager = MessagePackager()
-        self.max_packet_size = 4096
-        self.banner = socket.getfqdn().encode()
+        self.max_packet_size = max_packet_size
+        # sessions send from different threads, header and data must not interleave
+        self.send_lock = threading.Lock()
+        self.banner = None
+        self.device_version = None
         self.auth_token, self.auth_signature, self.auth_rsapubkey = 1, 2, 3
 
     def send(self, message):
-        logger.debug('Sending message: %s', message['tag'])
-        self.usb_handler.write(self.packager.pack_header(message))
-        self.usb_handler.write(message.get('data', b''))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Sending message: %s', message['tag'])
+        header = self.packager.pack_header(message)
+        with self.send_lock:
+            self.usb_handler.write(header)
+            self.usb_handler.write(message.get('data', b''))
 
     def send_okay(self, message):
         message = dict(
@@ -181,6 +246,9 @@ class AdbUsbClient(AdbClient):
 
     def connect(self):
         logger.info('Starting connect()')
+        if self.banner is None:
+            import socket  # only needed once per connection, fqdn lookup is slow anyway
+            self.banner = socket.getfqdn().encode()
         message = dict(
             tag=b'CNXN',
             arg0=self.VERSION,
@@ -190,7 +258,7 @@ class AdbUsbClient(AdbClient):
         self.send(message)
         connect_message = self.read_until_tag([b'CNXN', b'AUTH'])
         if connect_message['tag'] == b'CNXN':
-            return connect_message['data']
+            return self.connected(connect_message)
         elif connect_message['tag'] == b'AUTH':
             return self.auth(connect_message)
         else:
@@ -201,7 +269,7 @@ class AdbUsbClient(AdbClient):
         if not self.rsa_keys:
             raise DeviceAuthError('Device authentication required')
         else:
-            for rsa_key in self.rsa_keys:
+            for rsa_key in self.get_ordered_rsa_keys():
                 if message['arg0'] != self.auth_token:
                     raise InvalidResponseError('Unknown AUTH request: %s' % message)
                 msg = dict(
@@ -213,11 +281,14 @@ class AdbUsbClient(AdbClient):
                 self.send(msg)
                 auth_message = self.read_until_tag([b'CNXN', b'AUTH'])
                 if auth_message['tag'] == b'CNXN':
-                    return auth_message['data']
+                    self.remember_accepted_key(rsa_key)
+                    return self.connected(auth_message)
+                # Device rejected signature and sent a new token to sign
+                message = auth_message
 
             # None of the keys worked, so send a public key.
             msg = {
-                'cmd': b'AUTH',
+                'tag': b'AUTH',
                 'arg0': self.auth_rsapubkey,
                 'arg1': 0,
                 'data': self.rsa_keys[0].get_public_key() + b'\0'
@@ -226,38 +297,75 @@ class AdbUsbClient(AdbClient):
             try:
                 auth_message = self.read_until_tag([b'CNXN'])
             except ReadFailedError as e:
-                if e.usb_error.value == -7:  # Timeout.
+                if e.usb_error.value == LIBUSB_ERROR_TIMEOUT:
                     raise DeviceAuthError('Accept auth key on device, then retry.')
                 raise
             else:
-                return auth_message['data']
-
-    def read(self):
-        message = self.packager.unpack_header(
-            self.usb_handler.read(24)
-        )
+                self.remember_accepted_key(self.rsa_keys[0])
+                return self.connected(auth_message)
+
+    def connected(self, message):
+        """ Handles device CNXN, returns device banner """
+        self.device_version = message['arg0']
+        logger.info('Device protocol version: %#x', self.device_version)
+        return message['data']
+
+    def verify_required(self, message):
+        if self.device_version is None:
+            # before handshake is over device may already skip checksums, it sends 0 then
+            return message['checksum'] != 0
+        return self.device_version < self.VERSION_SKIP_CHECKSUM
+
+    def get_ordered_rsa_keys(self):
+        """ Keys in user order, except the one this device accepted last time goes first """
+        with self.accepted_keys_lock:
+            accepted_key = self.accepted_keys.get(self.source)
+        return sorted(self.rsa_keys, key=lambda rsa_key: rsa_key.get_public_key() != accepted_key)
+
+    def remember_accepted_key(self, rsa_key):
+        with self.accepted_keys_lock:
+            self.accepted_keys[self.source] = rsa_key.get_public_key()
+
+    def read(self, allow_idle=False):
+        """Reads one message from device.
+
+        With allow_idle, timeout while waiting for the header means device has nothing to say, None is returned.
+        Timeout in the middle of the payload is an error anyway.
+        """
+        try:
+            header = self.usb_handler.read(24)
+        except ReadFailedError as e:
+            if allow_idle and e.usb_error.value == LIBUSB_ERROR_TIMEOUT:
+                return None
+            raise
+        message = self.packager.unpack_header(header)
         if not message['data_len']:
             data = b''
         else:
-            logger.debug('Starting data read, len: %s', message['data_len'])
-            data = bytearray()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Starting data read, len: %s', message['data_len'])
+            chunks = []
             while message['data_len']:
                 buffer_ = self.usb_handler.read(message['data_len'])
                 if len(buffer_) != message['data_len']:
                     logger.warning("Data_length {} does not match actual number of bytes read: {}".format(
                         message['data_len'], len(buffer_))
                     )
-                data += buffer_
+                chunks.append(buffer_)
                 message['data_len'] -= len(buffer_)
-            self.packager.verify(data, message['checksum'])
-            logger.debug('Received packet body: %s', data)
+            # payload is passed on as it came from transport, joined only if it came in parts
+            data = chunks[0] if len(chunks) == 1 else b''.join(chunks)
+            if self.verify_required(message):
+                self.packager.verify(data, message['checksum'])
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Received packet body: %s', data)
         if message['tag'] == b'WRTE':
             self.send_okay(message)
         return {
             'tag': message['tag'],
             'arg0': message['arg0'],
             'arg1': message['arg1'],
-            'data': bytes(data)
+            'data': data
         }
 
     def read_until_tag(self, expecting_tags):
@@ -4,3 +4,7 @@ class InvalidResponseError(Exception):
 
 class InvalidChecksumError(Exception):
     """Checksum of data didn't match expected checksum."""
+
+
+class CaptureTimeoutError(Exception):
+    """Device didn't finish sending the frame in time."""
@@ -0,0 +1,261 @@
+""" Screen capture into preallocated NumPy frames
+
+Reads raw `screencap` (or `framebuffer:`) output, so there is no PNG encoding on the device and no decoding here.
+Header is parsed once, on the first frame; every next frame only has its header compared with the first one,
+while pixel data is copied from incoming packets straight into a frame taken from a reusable pool.
+"""
+
+import struct
+import logging
+import threading
+import collections
+import queue as q
+
+import numpy as np
+
+from py_adb.adb_exceptions import InvalidResponseError, CaptureTimeoutError
+
+logger = logging.getLogger(__name__)
+
+
+# screencap pixel format -> bytes per pixel (RGBA_8888, RGBX_8888, RGB_888, RGB_565, BGRA_8888)
+SCREENCAP_FORMATS = {1: 4, 2: 4, 3: 3, 4: 2, 5: 4}
+
+FrameGeometry = collections.namedtuple(
+    'FrameGeometry', ['width', 'height', 'bytes_per_pixel', 'header_size', 'pixel_format']
+)
+
+
+def parse_screencap_header(data):
+    """Parses geometry of complete raw screencap output.
+
+    Header is (width, height, format) and, since Android O, colorspace, so its size is deduced from the output length.
+    """
+    if len(data) < 12:
+        raise InvalidResponseError('Screencap output is too short: %r' % bytes(data))
+    width, height, pixel_format = struct.unpack_from('<3I', data)
+    if pixel_format not in SCREENCAP_FORMATS:
+        raise InvalidResponseError('Unknown screencap pixel format: %s' % pixel_format)
+    bytes_per_pixel = SCREENCAP_FORMATS[pixel_format]
+    header_size = len(data) - width * height * bytes_per_pixel
+    if header_size not in (12, 16):
+        raise InvalidResponseError(
+            'Unexpected screencap output length %s for %sx%s frame' % (len(data), width, height)
+        )
+    return FrameGeometry(width, height, bytes_per_pixel, header_size, pixel_format)
+
+
+def parse_framebuffer_header(data):
+    """Parses geometry of `framebuffer:` service output. Header is versioned, see adb framebuffer_service."""
+    if len(data) < 4:
+        raise InvalidResponseError('Framebuffer output is too short: %r' % bytes(data))
+    version, = struct.unpack_from('<I', data)
+    words = {16: 4, 1: 13, 2: 14}.get(version)
+    if words is None:
+        raise InvalidResponseError('Unknown framebuffer header version: %s' % version)
+    if len(data) < words * 4:
+        raise InvalidResponseError('Framebuffer output is too short for version %s header' % version)
+    if version == 16:
+        # legacy RGB_565: version, size, width, height
+        _, _, width, height = struct.unpack_from('<4I', data)
+        return FrameGeometry(width, height, 2, 16, 4)
+    else:
+        # version 2 has colorspace after bpp
+        fields = struct.unpack_from('<%dI' % words, data)
+        bpp, width, height = fields[1], fields[-10], fields[-9]
+        return FrameGeometry(width, height, bpp // 8, words * 4, None)
+
+
+class FrameBufferPool(object):
+    """ Preallocated frames of the same shape, handed out and taken back """
+    def __init__(self, shape, size):
+        self.shape = shape
+        self.size = size
+        self.free_frames = q.Queue()
+        for _ in range(size):
+            self.free_frames.put(np.empty(shape, dtype=np.uint8))
+
+    def acquire(self, timeout=None):
+        try:
+            return self.free_frames.get(timeout=timeout)
+        except q.Empty:
+            raise CaptureTimeoutError('No free frames in pool, release frames you are done with')
+
+    def release(self, frame):
+        self.free_frames.put(frame)
+
+
+class FrameReader(object):
+    """ Session consumer, lands pixel data of one capture directly into the frame """
+    def __init__(self, geometry, header, frame, pool):
+        self.geometry = geometry
+        self.header = header
+        self.header_changed = False
+        self.frame = frame
+        self.pixels = frame.reshape(-1)  # flat view, no copy
+        self.pool = pool
+        self.session = None
+        self.received = 0
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def feed(self, data):
+        with self.lock:
+            # nothing is written into the frame once session is finished, it may be back in the pool already
+            if not self.done.is_set():
+                self._feed(data)
+
+    def _feed(self, data):
+        chunk_start = self.received
+        self.received += len(data)
+        # header is not parsed again, only compared with the probed one: same length may still be another geometry
+        skip = max(self.geometry.header_size - chunk_start, 0)
+        if skip:
+            checked = min(skip, len(data))
+            if data[:checked] != self.header[chunk_start:chunk_start + checked]:
+                self.header_changed = True
+        offset = chunk_start + skip - self.geometry.header_size
+        count = min(len(data) - skip, self.pixels.size - offset)
+        if count > 0:
+            self.pixels[offset:offset + count] = np.frombuffer(data, dtype=np.uint8, count=count, offset=skip)
+
+    def finish(self):
+        with self.lock:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise CaptureTimeoutError('Frame was not received in %s seconds' % timeout)
+        if self.header_changed:
+            self.pool.release(self.frame)
+            raise InvalidResponseError(
+                'Capture header changed (screen rotated?), start new ScreenCapture for the new geometry'
+            )
+        expected = self.geometry.header_size + self.pixels.size
+        if self.received != expected:
+            self.pool.release(self.frame)
+            raise InvalidResponseError(
+                'Capture output length %s does not match expected %s' % (self.received, expected)
+            )
+        return self.frame
+
+
+class ProbeReader(object):
+    """ Session consumer for the first capture, keeps whole output to learn frame geometry """
+    def __init__(self):
+        self.data = bytearray()
+        self.frame = None
+        self.session = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def feed(self, data):
+        with self.lock:
+            if not self.done.is_set():
+                self.data += data
+
+    def finish(self):
+        with self.lock:
+            self.done.set()
+
+    def wait(self, timeout=None):
+        if not self.done.wait(timeout):
+            raise CaptureTimeoutError('Frame was not received in %s seconds' % timeout)
+        return self.data
+
+
+class ScreenCapture(object):
+    """Device screen capture on top of AdbSessionManager sessions.
+
+    Frames are (height, width, bytes_per_pixel) uint8 arrays in device pixel format.
+    Frames from grab() must be given back with release().
+    timeout_s is in seconds, unlike millisecond timeouts of the manager and handlers.
+    """
+    SOURCES = {
+        'screencap': (b'exec:screencap', parse_screencap_header),
+        'framebuffer': (b'framebuffer:', parse_framebuffer_header),
+    }
+
+    def __init__(self, manager, source='screencap', pool_size=4, timeout_s=10):
+        if source not in self.SOURCES:
+            raise ValueError('Unknown capture source: %s' % source)
+        self.manager = manager
+        self.command, self.parse_header = self.SOURCES[source]
+        self.pool_size = pool_size
+        self.timeout_s = timeout_s
+        self.geometry = None
+        self.header = None
+        self.pool = None
+
+    def probe(self):
+        reader = ProbeReader()
+        reader.session = self.manager.open_session(self.command, consumer=reader)
+        data = self.wait(reader)
+        self.geometry = self.parse_header(data)
+        self.header = bytes(data[:self.geometry.header_size])
+        logger.info('Capture geometry: %s', self.geometry)
+        self.pool = FrameBufferPool(
+            (self.geometry.height, self.geometry.width, self.geometry.bytes_per_pixel), self.pool_size
+        )
+        frame = self.pool.acquire()
+        frame.reshape(-1)[:] = np.frombuffer(data, dtype=np.uint8, count=frame.size, offset=self.geometry.header_size)
+        return frame
+
+    def request(self):
+        """ Starts capture of the next frame, returns reader to wait() on """
+        frame = self.pool.acquire(self.timeout_s)
+        reader = FrameReader(self.geometry, self.header, frame, self.pool)
+        try:
+            reader.session = self.manager.open_session(self.command, consumer=reader)
+        except Exception:
+            self.release(frame)
+            raise
+        return reader
+
+    def wait(self, reader):
+        """ Waits for requested capture, cancels it if device doesn't send it in time """
+        try:
+            return reader.wait(self.timeout_s)
+        except CaptureTimeoutError:
+            self.cancel(reader)
+            raise
+
+    def cancel(self, reader):
+        """ Closes capture session and gives its frame back to the pool """
+        if not reader.done.is_set():
+            # closed session is finished right away, router doesn't feed it anymore
+            self.manager.close_session(reader.session.local_id)
+        if reader.frame is not None:
+            self.release(reader.frame)
+
+    def grab(self):
+        if self.geometry is None:
+            return self.probe()
+        return self.wait(self.request())
+
+    def release(self, frame):
+        self.pool.release(frame)
+
+    def stream(self, depth=2):
+        """Continuous capture, keeps `depth` captures in flight while previous frame is processed.
+
+        Yielded frame goes back to the pool on the next iteration, copy it if you need to keep it.
+        """
+        frame = self.grab()
+        if self.pool_size < depth + 1:
+            self.release(frame)
+            raise ValueError('Pool of %s frames is too small for %s captures in flight' % (self.pool_size, depth))
+        in_flight = collections.deque(self.request() for _ in range(depth))
+        try:
+            while True:
+                yield frame
+                self.release(frame)
+                frame = None
+                in_flight.append(self.request())
+                frame = self.wait(in_flight.popleft())
+        finally:
+            if frame is not None:
+                self.release(frame)
+            # don't wait for captures in flight, their sessions are closed and frames are back in pool
+            for reader in in_flight:
+                self.cancel(reader)
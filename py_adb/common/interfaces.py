@@ -26,7 +26,7 @@ class AdbClient(object):
     def send_okay(self, message):
         raise NotImplementedError()
 
-    def read(self):
+    def read(self, allow_idle=False):
         raise NotImplementedError()
 
 
@@ -15,6 +15,7 @@ class MessagePackager(object):
             b'CNXN', b'AUTH', b'OPEN', b'WRTE', b'OKAY', b'CLSE',
             b'SYNC',
         ]
+        self.tags_by_id = {self.get_id_for_tag(tag): tag for tag in self.tags}
         self.magic = 0xFFFFFFFF
         self.fmt = b'<6I'  # An ADB message is 6 words in little-endian.
 
@@ -23,14 +24,14 @@ class MessagePackager(object):
         return sum(char << (idx * 8) for idx, char in enumerate(bytearray(tag)))
 
     def get_tag_for_id(self, id_):
-        for tag in self.tags:
-            if sum(char << (idx * 8) for idx, char in enumerate(bytearray(tag))) == id_:
-                return tag
-        else:
+        try:
+            return self.tags_by_id[id_]
+        except KeyError:
             raise ValueError('Unknown tag')
 
     def pack_header(self, message):
-        logger.debug('Packing header for message: %s', message)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Packing header for message: %s', message)
         return struct.pack(
             self.fmt,
             self.get_id_for_tag(message['tag']),
@@ -42,7 +43,8 @@ class MessagePackager(object):
         )
 
     def unpack_header(self, message):
-        logger.debug('Unpacking header: %s', message)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug('Unpacking header: %s', message)
         try:
             id_, arg0, arg1, len_, checksum, _ = struct.unpack(self.fmt, message)
             tag = self.get_tag_for_id(id_)
@@ -57,7 +59,8 @@ class MessagePackager(object):
                 'data_len': len_,
                 'checksum': checksum
             }
-            logger.debug('Unpacked header: %s', unpacked_message)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Unpacked header: %s', unpacked_message)
             return unpacked_message
 
     def checksum(self, data):
@@ -1,5 +1,5 @@
 import logging
-from handlers.usb_handler import UsbHandler
+import importlib
 
 logger = logging.getLogger(__name__)
 
@@ -7,15 +7,23 @@ logger = logging.getLogger(__name__)
 class HandlerFactory(object):
     DEFAULT_HANDLER = 'usb'
 
-    def __init__(self):
-        self.handlers = {
-            'usb': ('usb:', UsbHandler)
-        }
+    # name: (source prefix, module, class). Transport module is imported only when it is used.
+    handlers = {
+        'usb': ('usb:', 'py_adb.handlers.usb_handler', 'UsbHandler'),
+    }
+
+    @classmethod
+    def register_handler(cls, name, prefix, module, class_name):
+        cls.handlers[name] = (prefix, module, class_name)
+
+    def load_handler(self, name):
+        _, module, class_name = self.handlers[name]
+        return getattr(importlib.import_module(module), class_name)
 
     def get_handler(self, source):
         for name, signature in self.handlers.items():
             if source.startswith(signature[0]):
-                return signature[1](source)
+                return self.load_handler(name)(source)
         else:
             logger.info('Handler not found in known handlers, using default: %s', self.DEFAULT_HANDLER)
-            return self.handlers[self.DEFAULT_HANDLER][1](source)
+            return self.load_handler(self.DEFAULT_HANDLER)(source)
@@ -4,6 +4,7 @@ import weakref
 
 import libusb1
 from py_adb.common.interfaces import Handler
+from py_adb.usb_exceptions import LibusbWrappingError, ReadFailedError, WriteFailedError
 
 logger = logging.getLogger(__name__)
 
@@ -72,11 +73,14 @@ class UsbHandler(Handler):
             raise RuntimeError('USB endpoints not found')
 
     def open(self):
-        handle = self.device.open()
         interface = self.settings.getNumber()
-        if handle.kernelDriverActive(interface):
-            handle.detachKernelDriver(interface)
-        handle.claimInterface(interface)
+        try:
+            handle = self.device.open()
+            if handle.kernelDriverActive(interface):
+                handle.detachKernelDriver(interface)
+            handle.claimInterface(interface)
+        except usb1.USBError as e:
+            raise LibusbWrappingError('Failed to open usb device %s' % self.source, e)
         self.handle = handle
         self.interface_number = interface
         logger.debug('Opened usb handler: %s. Iface: %s', self.handle, self.interface_number)
@@ -100,15 +104,16 @@ class UsbHandler(Handler):
     def write(self, data):
         try:
             self.handle.bulkWrite(self.__write_endpoint, data, timeout=self.timeout)
-        except usb1.USBError:
+        except usb1.USBError as e:
             logger.warning('Usb write failed, data: %s', data)
-            raise
+            raise WriteFailedError('Usb write failed', e)
 
     def read(self, length):
         try:
             chunk = self.handle.bulkRead(self.__read_endpoint, length, timeout=self.timeout)
-        except usb1.USBError:
-            logger.warning('Usb read failed')
-            raise
+        except usb1.USBError as e:
+            if e.value != libusb1.LIBUSB_ERROR_TIMEOUT:
+                logger.warning('Usb read failed')
+            raise ReadFailedError('Usb read failed', e)
         else:
-            return bytearray(chunk)
+            return chunk
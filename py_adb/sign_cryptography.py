@@ -0,0 +1,139 @@
+import os
+import base64
+import struct
+import getpass
+import socket
+import threading
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa, utils
+
+from py_adb.common.interfaces import AuthSigner
+
+
+ANDROID_PUBKEY_MODULUS_SIZE = 2048 // 8  # adb only accepts 2048 bit keys.
+ANDROID_PUBKEY_WORDS = ANDROID_PUBKEY_MODULUS_SIZE // 4
+
+_keys_cache = {}
+_keys_cache_lock = threading.Lock()
+
+
+def _int_to_words(value, words):
+    """ Little-endian uint32 words, as laid out in android's RSAPublicKey struct """
+    return struct.pack('<%dI' % words, *[(value >> (32 * idx)) & 0xFFFFFFFF for idx in range(words)])
+
+
+def _default_comment():
+    """ user@host as adb writes it, unknown parts fall back to 'unknown' same as adb does """
+    try:
+        user = getpass.getuser()
+    except (KeyError, OSError):
+        # no passwd entry and no USER/LOGNAME, e.g. in containers
+        user = 'unknown'
+    try:
+        host = socket.gethostname() or 'unknown'
+    except socket.error:
+        host = 'unknown'
+    return '%s@%s' % (user, host)
+
+
+def encode_android_public_key(public_key, comment=None):
+    """Encodes RSA public key in the format adbd keeps in adb_keys.
+
+    base64(RSAPublicKey struct: len, n0inv, n, rr, exponent) followed by ' user@host'
+    """
+    numbers = public_key.public_numbers()
+    if public_key.key_size != ANDROID_PUBKEY_MODULUS_SIZE * 8:
+        raise ValueError('Android only supports %s bit RSA keys' % (ANDROID_PUBKEY_MODULUS_SIZE * 8))
+    # -1 / n[0] mod 2^32, newton iterations double correct bits each step (n is odd)
+    inverse = 1
+    for _ in range(5):
+        inverse = (inverse * (2 - numbers.n * inverse)) & 0xFFFFFFFF
+    n0inv = (-inverse) & 0xFFFFFFFF
+    rr = pow(2, ANDROID_PUBKEY_MODULUS_SIZE * 8 * 2, numbers.n)
+    key_struct = b''.join([
+        struct.pack('<II', ANDROID_PUBKEY_WORDS, n0inv),
+        _int_to_words(numbers.n, ANDROID_PUBKEY_WORDS),
+        _int_to_words(rr, ANDROID_PUBKEY_WORDS),
+        struct.pack('<I', numbers.e),
+    ])
+    if comment is None:
+        comment = _default_comment()
+    return base64.b64encode(key_struct) + b' ' + comment.encode()
+
+
+def _get_mtimes(rsa_key_path):
+    """ Modification times of private and public key files, None for missing .pub """
+    try:
+        pub_mtime = os.stat(rsa_key_path + '.pub').st_mtime
+    except OSError:
+        pub_mtime = None
+    return os.stat(rsa_key_path).st_mtime, pub_mtime
+
+
+def _load_key_pair(rsa_key_path):
+    """ Reads and parses private key and its public part once per process, again if either file changes """
+    rsa_key_path = os.path.abspath(os.path.expanduser(rsa_key_path))
+    mtimes = _get_mtimes(rsa_key_path)
+    with _keys_cache_lock:
+        cached = _keys_cache.get(rsa_key_path)
+        if cached and cached[0] == mtimes:
+            return cached[1], cached[2]
+        with open(rsa_key_path, 'rb') as rsa_file:
+            private_key = serialization.load_pem_private_key(
+                rsa_file.read(), password=None, backend=default_backend()
+            )
+        try:
+            with open(rsa_key_path + '.pub', 'rb') as rsa_pub_file:
+                public_key = rsa_pub_file.read().strip()
+        except IOError:
+            public_key = encode_android_public_key(private_key.public_key())
+        _keys_cache[rsa_key_path] = (mtimes, private_key, public_key)
+        return private_key, public_key
+
+
+def generate_adbkey(rsa_key_path, comment=None):
+    """Generates new adbkey/adbkey.pub pair, stores it on disk and in keys cache.
+
+    Private key is written as unencrypted PKCS#8 PEM, public key in android format, same as adb does.
+    Use CryptographySigner to sign with it.
+    """
+    rsa_key_path = os.path.abspath(os.path.expanduser(rsa_key_path))
+    private_key = rsa.generate_private_key(
+        public_exponent=65537, key_size=ANDROID_PUBKEY_MODULUS_SIZE * 8, backend=default_backend()
+    )
+    key_dir = os.path.dirname(rsa_key_path)
+    if not os.path.isdir(key_dir):
+        os.makedirs(key_dir, 0o750)
+    fd = os.open(rsa_key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'wb') as rsa_file:
+        rsa_file.write(private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption()
+        ))
+    public_key = encode_android_public_key(private_key.public_key(), comment)
+    with open(rsa_key_path + '.pub', 'wb') as rsa_pub_file:
+        rsa_pub_file.write(public_key + b'\n')
+    with _keys_cache_lock:
+        _keys_cache[rsa_key_path] = (_get_mtimes(rsa_key_path), private_key, public_key)
+
+
+class CryptographySigner(AuthSigner):
+    """AuthSigner using cryptography.
+
+    Keys are parsed once per process and shared between signers pointing to the same path.
+    """
+
+    def __init__(self, rsa_key_path, generate=False):
+        if generate and not os.path.exists(os.path.expanduser(rsa_key_path)):
+            generate_adbkey(rsa_key_path)
+        self.rsa_key, self.public_key = _load_key_pair(rsa_key_path)
+
+    def sign(self, data):
+        # adbd hands out 20 bytes token and verifies it as an already computed sha1 digest
+        return self.rsa_key.sign(bytes(data), padding.PKCS1v15(), utils.Prehashed(hashes.SHA1()))
+
+    def get_public_key(self):
+        return self.public_key
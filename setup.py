@@ -18,6 +18,11 @@ inspired by https://github.com/google/python-adb
     ],
     tests_require=[
     ],
+    extras_require={
+        'cryptography': ['cryptography'],
+        'm2crypto': ['M2Crypto'],
+        'capture': ['numpy'],
+    },
     entry_points={
         'console_scripts': [
             'py_adb = py_adb.demo:main',
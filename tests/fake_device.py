@@ -0,0 +1,126 @@
+""" Device side of the adb protocol for tests
+
+Register with HandlerFactory.register_handler('fake', 'fake:', 'fake_device', 'FakeDeviceHandler'),
+describe the device with add_device() and connect to its source as to a real one.
+"""
+
+import struct
+import threading
+import collections
+
+from py_adb.common.interfaces import Handler
+from py_adb.common.packager import MessagePackager
+from py_adb.usb_exceptions import ReadFailedError
+
+VERSION_SKIP_CHECKSUM = 0x01000001
+
+devices = {}
+
+
+class FakeUsbError(Exception):
+    def __init__(self, value):
+        super(FakeUsbError, self).__init__(value)
+        self.value = value
+
+
+class FakeDevice(object):
+    """Scripted device.
+
+    accepted_signer: signer whose signatures device trusts, None for a device without auth.
+    services: {command: [payload, ...]}, answered with OKAY, WRTE for each payload and CLSE.
+        Commands not in services are refused with CLSE.
+    """
+    def __init__(self, version=VERSION_SKIP_CHECKSUM, accepted_signer=None, accept_new_keys=False,
+                 services=None, read_timeout_s=0.2):
+        self.version = version
+        self.accepted_signer = accepted_signer
+        self.accept_new_keys = accept_new_keys
+        self.services = services or {}
+        self.read_timeout_s = read_timeout_s
+        self.received = []  # messages from host
+        self.signatures = []  # (token, signature) pairs host sent
+        self.public_keys = []
+        self.tokens = ('token-%014d' % idx for idx in range(1 << 31))
+        self.token = None
+        self.remote_ids = iter(range(1000, 1 << 31))
+
+
+def add_device(source, **kwargs):
+    device = devices[source] = FakeDevice(**kwargs)
+    return device
+
+
+class FakeDeviceHandler(Handler):
+    """ Transport to FakeDevice, every read returns a whole header or a whole payload """
+    def __init__(self, source):
+        super(FakeDeviceHandler, self).__init__()
+        self.device = devices[source]
+        self.packager = MessagePackager()
+        self.pieces = collections.deque()
+        self.available = threading.Condition()
+        self.header = None
+
+    def emit(self, tag, arg0, arg1, data=b''):
+        checksum = self.packager.checksum(data) if self.device.version < VERSION_SKIP_CHECKSUM else 0
+        tag_id = self.packager.get_id_for_tag(tag)
+        self.emit_raw(struct.pack('<6I', tag_id, arg0, arg1, len(data), checksum, tag_id ^ 0xFFFFFFFF), data)
+
+    def emit_raw(self, header, data=b''):
+        with self.available:
+            self.pieces.append(header)
+            if data:
+                self.pieces.append(data)
+            self.available.notify()
+
+    def send_token(self):
+        self.device.token = next(self.device.tokens).encode()
+        self.emit(b'AUTH', 1, 0, self.device.token)
+
+    def connected(self):
+        self.emit(b'CNXN', self.device.version, 4096, b'device::fake\0')
+
+    def write(self, data):
+        if self.header is None:
+            self.header = self.packager.unpack_header(bytes(data))
+            return
+        message, self.header = self.header, None
+        message['data'] = bytes(data)
+        self.device.received.append(message)
+        self.respond(message)
+
+    def respond(self, message):
+        device = self.device
+        if message['tag'] == b'CNXN':
+            if device.accepted_signer:
+                self.send_token()
+            else:
+                self.connected()
+        elif message['tag'] == b'AUTH' and message['arg0'] == 2:
+            device.signatures.append((device.token, message['data']))
+            if message['data'] == device.accepted_signer.sign(device.token):
+                self.connected()
+            else:
+                self.send_token()
+        elif message['tag'] == b'AUTH' and message['arg0'] == 3:
+            device.public_keys.append(message['data'])
+            if device.accept_new_keys:
+                self.connected()
+        elif message['tag'] == b'OPEN':
+            command, local_id = message['data'].rstrip(b'\0'), message['arg0']
+            if command not in device.services:
+                self.emit(b'CLSE', 0, local_id)
+                return
+            remote_id = next(device.remote_ids)
+            self.emit(b'OKAY', remote_id, local_id)
+            for payload in device.services[command]:
+                self.emit(b'WRTE', remote_id, local_id, payload)
+            self.emit(b'CLSE', remote_id, local_id)
+
+    def read(self, length):
+        with self.available:
+            if not self.pieces and not self.available.wait(self.device.read_timeout_s):
+                raise ReadFailedError('Fake read timed out', FakeUsbError(-7))
+            return self.pieces.popleft()
+
+    def close(self):
+        pass
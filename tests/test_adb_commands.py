@@ -0,0 +1,102 @@
+import os
+import sys
+import struct
+import subprocess
+
+import pytest
+
+import fake_device
+from py_adb.adb_commands import AdbUsbClient, AdbSessionManager
+from py_adb.handle import HandlerFactory
+from py_adb.usb_exceptions import DeviceAuthError, ReadFailedError
+
+
+class FakeSigner(object):
+    def __init__(self, name):
+        self.name = name
+
+    def sign(self, data):
+        return self.name + b':' + bytes(data)
+
+    def get_public_key(self):
+        return b'pubkey-' + self.name
+
+
+@pytest.fixture(autouse=True)
+def fake_transport():
+    HandlerFactory.register_handler('fake', 'fake:', 'fake_device', 'FakeDeviceHandler')
+    AdbUsbClient.accepted_keys.clear()
+    yield
+    fake_device.devices.clear()
+
+
+def test_rejected_signature_is_followed_by_signing_new_token():
+    key_a, key_b = FakeSigner(b'A'), FakeSigner(b'B')
+    device = fake_device.add_device('fake:auth', accepted_signer=key_b)
+    assert AdbUsbClient('fake:auth', [key_a, key_b]).connect() == b'device::fake\0'
+    (first_token, first_signature), (second_token, second_signature) = device.signatures
+    assert first_token != second_token
+    assert first_signature == key_a.sign(first_token)
+    assert second_signature == key_b.sign(second_token)
+
+
+def test_reconnect_signs_once_with_last_accepted_key():
+    key_a, key_b = FakeSigner(b'A'), FakeSigner(b'B')
+    device = fake_device.add_device('fake:auth', accepted_signer=key_b)
+    AdbUsbClient('fake:auth', [key_a, key_b]).connect()
+    del device.signatures[:]
+
+    AdbUsbClient('fake:auth', [key_a, key_b]).connect()
+    assert device.signatures == [(device.token, key_b.sign(device.token))]
+
+
+def test_public_key_is_sent_when_no_key_is_accepted():
+    key_a, key_b = FakeSigner(b'A'), FakeSigner(b'B')
+    device = fake_device.add_device('fake:auth', accepted_signer=FakeSigner(b'C'), accept_new_keys=True)
+    assert AdbUsbClient('fake:auth', [key_a, key_b]).connect() == b'device::fake\0'
+    assert device.public_keys == [b'pubkey-A\0']
+    assert AdbUsbClient.accepted_keys['fake:auth'] == b'pubkey-A'
+
+
+def test_public_key_waiting_for_user_times_out():
+    fake_device.add_device('fake:auth', accepted_signer=FakeSigner(b'C'))
+    with pytest.raises(DeviceAuthError):
+        AdbUsbClient('fake:auth', [FakeSigner(b'A')]).connect()
+
+
+def test_read_returns_none_only_on_idle_header():
+    fake_device.add_device('fake:idle')
+    client = AdbUsbClient('fake:idle', None)
+    assert client.read(allow_idle=True) is None
+    with pytest.raises(ReadFailedError):
+        client.read()
+
+
+def test_read_timeout_in_payload_is_error():
+    fake_device.add_device('fake:idle')
+    client = AdbUsbClient('fake:idle', None)
+    tag_id = client.packager.get_id_for_tag(b'WRTE')
+    client.usb_handler.emit_raw(struct.pack('<6I', tag_id, 1, 1, 10, 0, tag_id ^ 0xFFFFFFFF))
+    with pytest.raises(ReadFailedError):
+        client.read(allow_idle=True)
+
+
+@pytest.mark.filterwarnings('ignore::pytest.PytestUnhandledThreadExceptionWarning')
+def test_open_session_fails_fast_when_router_stopped():
+    device = fake_device.add_device('fake:router', services={b'shell:true': []})
+    manager = AdbSessionManager('fake:router')
+    manager.open_session(b'shell:true')
+    manager.client.usb_handler.emit_raw(b'\0' * 24)  # unknown tag stops the router
+    manager.router.join(2)
+    with pytest.raises(RuntimeError):
+        manager.open_session(b'shell:true')
+    assert len([message for message in device.received if message['tag'] == b'OPEN']) == 1
+
+
+def test_core_import_does_not_load_transports():
+    heavy_modules = ['usb1', 'libusb1', 'netort', 'socket', 'py_adb.handlers.usb_handler']
+    loaded = subprocess.check_output([
+        sys.executable, '-c',
+        'import sys, py_adb.adb_commands; print(" ".join(m for m in %r if m in sys.modules))' % heavy_modules
+    ], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).decode().split()
+    assert loaded == []
@@ -0,0 +1,223 @@
+import time
+import struct
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import fake_device
+from py_adb.adb_commands import AdbSessionManager
+from py_adb.adb_exceptions import InvalidResponseError, CaptureTimeoutError
+from py_adb.capture import (
+    ScreenCapture, FrameReader, FrameBufferPool, FrameGeometry, parse_screencap_header, parse_framebuffer_header
+)
+from py_adb.handle import HandlerFactory
+
+WIDTH, HEIGHT = 6, 4
+
+
+def screencap_output(width=WIDTH, height=HEIGHT, seed=0, header_size=16):
+    header = struct.pack('<4I', width, height, 1, 0)[:header_size]
+    pixels = ((np.arange(width * height * 4) + seed) % 251).astype(np.uint8).tobytes()
+    return header + pixels
+
+
+def chunks(data, size):
+    return [data[start:start + size] for start in range(0, len(data), size)]
+
+
+def frame_of(output, header_size=16):
+    return np.frombuffer(output, dtype=np.uint8, offset=header_size).reshape(HEIGHT, WIDTH, 4)
+
+
+@pytest.fixture
+def device():
+    HandlerFactory.register_handler('fake', 'fake:', 'fake_device', 'FakeDeviceHandler')
+    device = fake_device.add_device('fake:capture', services={
+        b'exec:screencap': chunks(screencap_output(), 7),
+    })
+    yield device
+    fake_device.devices.clear()
+
+
+@pytest.fixture
+def manager(device):
+    return AdbSessionManager('fake:capture')
+
+
+class SilentManager(object):
+    """ Opens sessions device never answers """
+    class Session(object):
+        def __init__(self, local_id):
+            self.local_id = local_id
+
+    def __init__(self):
+        self.opened, self.closed = 0, []
+
+    def open_session(self, command, consumer=None):
+        self.opened += 1
+        return self.Session(self.opened)
+
+    def close_session(self, local_id):
+        self.closed.append(local_id)
+
+
+def test_parse_screencap_header_12_and_16_bytes():
+    assert parse_screencap_header(screencap_output(header_size=12)) == FrameGeometry(WIDTH, HEIGHT, 4, 12, 1)
+    assert parse_screencap_header(screencap_output(header_size=16)) == FrameGeometry(WIDTH, HEIGHT, 4, 16, 1)
+
+
+@pytest.mark.parametrize('output', [b'', b'screencap: not found\n'[:10]])
+def test_parse_screencap_header_short_output(output):
+    with pytest.raises(InvalidResponseError):
+        parse_screencap_header(output)
+
+
+def test_parse_screencap_header_length_mismatch():
+    with pytest.raises(InvalidResponseError):
+        parse_screencap_header(screencap_output()[:-1])
+
+
+def test_parse_framebuffer_headers():
+    v1 = struct.pack('<13I', 1, 32, WIDTH * HEIGHT * 4, WIDTH, HEIGHT, 0, 8, 16, 8, 8, 8, 24, 8)
+    v2 = struct.pack('<14I', 2, 32, 0, WIDTH * HEIGHT * 4, WIDTH, HEIGHT, 0, 8, 16, 8, 8, 8, 24, 8)
+    v16 = struct.pack('<4I', 16, WIDTH * HEIGHT * 2, WIDTH, HEIGHT)
+    assert parse_framebuffer_header(v1) == FrameGeometry(WIDTH, HEIGHT, 4, 52, None)
+    assert parse_framebuffer_header(v2) == FrameGeometry(WIDTH, HEIGHT, 4, 56, None)
+    assert parse_framebuffer_header(v16) == FrameGeometry(WIDTH, HEIGHT, 2, 16, 4)
+
+
+@pytest.mark.parametrize('output', [b'', b'\x01\x00', struct.pack('<3I', 1, 32, 0), struct.pack('<I', 7)])
+def test_parse_framebuffer_header_bad_output(output):
+    with pytest.raises(InvalidResponseError):
+        parse_framebuffer_header(output)
+
+
+def make_reader(output, pool_size=1):
+    geometry = parse_screencap_header(screencap_output())
+    pool = FrameBufferPool((HEIGHT, WIDTH, 4), pool_size)
+    return FrameReader(geometry, screencap_output()[:16], pool.acquire(), pool), pool
+
+
+@pytest.mark.parametrize('size', [1, 5, 16, 17, 1000])
+def test_frame_reader_header_split_across_chunks(size):
+    output = screencap_output(seed=3)
+    reader, _ = make_reader(output)
+    for chunk in chunks(output, size):
+        reader.feed(memoryview(chunk))
+    reader.finish()
+    assert np.array_equal(reader.wait(0), frame_of(output))
+
+
+def test_frame_reader_length_mismatch_releases_frame():
+    reader, pool = make_reader(screencap_output())
+    reader.feed(screencap_output()[:-4])
+    reader.finish()
+    with pytest.raises(InvalidResponseError):
+        reader.wait(0)
+    assert pool.free_frames.qsize() == 1
+
+
+def test_frame_reader_header_change_releases_frame():
+    rotated = screencap_output(width=HEIGHT, height=WIDTH)
+    reader, pool = make_reader(rotated)
+    for chunk in chunks(rotated, 5):
+        reader.feed(chunk)
+    reader.finish()
+    with pytest.raises(InvalidResponseError):
+        reader.wait(0)
+    assert pool.free_frames.qsize() == 1
+
+
+def test_pool_exhaustion():
+    pool = FrameBufferPool((HEIGHT, WIDTH, 4), 2)
+    pool.acquire(), pool.acquire()
+    with pytest.raises(CaptureTimeoutError):
+        pool.acquire(timeout=0.01)
+
+
+def test_grab_through_session(manager):
+    capture = ScreenCapture(manager)
+    for _ in range(3):
+        frame = capture.grab()
+        assert np.array_equal(frame, frame_of(screencap_output()))
+        capture.release(frame)
+    assert capture.pool.free_frames.qsize() == capture.pool_size
+
+
+def test_grab_after_rotation_fails(device, manager):
+    capture = ScreenCapture(manager)
+    capture.release(capture.grab())
+    device.services[b'exec:screencap'] = chunks(screencap_output(width=HEIGHT, height=WIDTH), 7)
+    with pytest.raises(InvalidResponseError):
+        capture.grab()
+    assert capture.pool.free_frames.qsize() == capture.pool_size
+
+
+def test_refused_service(device, manager):
+    del device.services[b'exec:screencap']
+    with pytest.raises(InvalidResponseError):
+        ScreenCapture(manager).grab()
+
+
+def test_timed_out_capture_closes_session_and_returns_frame(manager):
+    capture = ScreenCapture(manager, pool_size=2, timeout_s=0.1)
+    capture.release(capture.grab())
+    capture.manager = silent = SilentManager()
+    for _ in range(3):
+        with pytest.raises(CaptureTimeoutError):
+            capture.grab()
+    assert silent.closed == [1, 2, 3]
+    assert capture.pool.free_frames.qsize() == 2
+
+
+def test_stream_closed_early_returns_frames(manager):
+    capture = ScreenCapture(manager, pool_size=4)
+    stream = capture.stream(depth=2)
+    for _, frame in zip(range(5), stream):
+        assert np.array_equal(frame, frame_of(screencap_output()))
+    capture.manager = SilentManager()
+    started = time.time()
+    stream.close()
+    assert time.time() - started < 1
+    assert capture.pool.free_frames.qsize() == 4
+
+
+def test_stream_needs_big_enough_pool(manager):
+    capture = ScreenCapture(manager, pool_size=2)
+    with pytest.raises(ValueError):
+        next(capture.stream(depth=2))
+
+
+def read_session(session, timeout_s=2):
+    data, deadline = [], time.time() + timeout_s
+    for received in session.get():
+        data.extend(received)
+        assert time.time() < deadline, 'session did not finish'
+    return b''.join(data)
+
+
+def test_session_get_ends_on_close(device, manager):
+    device.services[b'shell:echo 123'] = [b'12', b'3\n']
+    assert read_session(manager.open_session(b'shell:echo 123')) == b'123\n'
+    assert not manager.sessions
+
+
+def test_failing_consumer_closes_only_its_session(device, manager):
+    class FailingConsumer(object):
+        def feed(self, data):
+            raise ValueError('broken consumer')
+
+        def finish(self):
+            raise ValueError('broken consumer')
+
+    device.services[b'shell:echo 123'] = [b'123\n']
+    session = manager.open_session(b'exec:screencap', consumer=FailingConsumer())
+    deadline = time.time() + 2
+    while not session.finished and time.time() < deadline:
+        time.sleep(0.01)
+    assert session.finished
+    assert manager.router.is_alive()
+    assert read_session(manager.open_session(b'shell:echo 123')) == b'123\n'
+    closed = [message for message in device.received if message['tag'] == b'CLSE']
+    assert [message['arg0'] for message in closed] == [session.local_id]
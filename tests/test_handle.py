@@ -0,0 +1,32 @@
+import sys
+
+import pytest
+
+from py_adb.handle import HandlerFactory
+
+
+@pytest.fixture
+def lazy_transport(tmp_path, monkeypatch):
+    (tmp_path / 'lazy_transport.py').write_text(
+        'class LazyHandler(object):\n'
+        '    def __init__(self, source):\n'
+        '        self.source = source\n'
+    )
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(HandlerFactory, 'handlers', dict(HandlerFactory.handlers))
+    yield
+    sys.modules.pop('lazy_transport', None)
+
+
+def test_registered_handler_is_imported_on_first_use(lazy_transport):
+    HandlerFactory.register_handler('lazy', 'lazy:', 'lazy_transport', 'LazyHandler')
+    assert 'lazy_transport' not in sys.modules
+    handler = HandlerFactory().get_handler('lazy:1')
+    assert 'lazy_transport' in sys.modules
+    assert type(handler).__name__ == 'LazyHandler'
+    assert handler.source == 'lazy:1'
+
+
+def test_unknown_source_uses_default_handler(lazy_transport):
+    HandlerFactory.handlers[HandlerFactory.DEFAULT_HANDLER] = ('usb:', 'lazy_transport', 'LazyHandler')
+    assert HandlerFactory().get_handler('3709e945').source == '3709e945'
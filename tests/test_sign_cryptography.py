@@ -0,0 +1,83 @@
+import os
+import base64
+import struct
+import getpass
+
+import pytest
+
+pytest.importorskip('cryptography')
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, utils
+
+from py_adb import sign_cryptography
+from py_adb.sign_cryptography import CryptographySigner, generate_adbkey, ANDROID_PUBKEY_WORDS
+
+
+def words_to_int(data):
+    return sum(word << (32 * idx) for idx, word in enumerate(struct.unpack('<%dI' % (len(data) // 4), data)))
+
+
+def decode_android_public_key(public_key):
+    encoded, comment = public_key.split(b' ', 1)
+    key_struct = base64.b64decode(encoded)
+    words = ANDROID_PUBKEY_WORDS
+    length, n0inv = struct.unpack_from('<II', key_struct)
+    n = words_to_int(key_struct[8:8 + words * 4])
+    rr = words_to_int(key_struct[8 + words * 4:8 + words * 8])
+    exponent, = struct.unpack_from('<I', key_struct, 8 + words * 8)
+    return len(key_struct), length, n0inv, n, rr, exponent, comment
+
+
+@pytest.fixture
+def signer(tmp_path):
+    generate_adbkey(str(tmp_path / 'adbkey'), comment='test@host')
+    return CryptographySigner(str(tmp_path / 'adbkey'))
+
+
+def test_public_key_matches_android_struct(signer):
+    numbers = signer.rsa_key.public_key().public_numbers()
+    struct_len, length, n0inv, n, rr, exponent, comment = decode_android_public_key(signer.get_public_key())
+    assert struct_len == 524
+    assert length == 64
+    assert n == numbers.n
+    assert exponent == numbers.e
+    assert (n0inv * n) % (1 << 32) == (1 << 32) - 1
+    assert rr == pow(2, 4096, n)
+    assert comment == b'test@host'
+
+
+def test_sign_verifies_as_prehashed_sha1(signer):
+    token = os.urandom(20)
+    signature = signer.sign(token)
+    signer.rsa_key.public_key().verify(signature, token, padding.PKCS1v15(), utils.Prehashed(hashes.SHA1()))
+
+
+def test_keys_are_cached_until_public_key_changes(tmp_path, signer):
+    rsa_key_path = str(tmp_path / 'adbkey')
+    cached = CryptographySigner(rsa_key_path)
+    assert cached.rsa_key is signer.rsa_key
+
+    with open(rsa_key_path + '.pub', 'wb') as rsa_pub_file:
+        rsa_pub_file.write(b'replaced\n')
+    stat = os.stat(rsa_key_path + '.pub')
+    os.utime(rsa_key_path + '.pub', (stat.st_atime, stat.st_mtime + 10))
+    assert CryptographySigner(rsa_key_path).get_public_key() == b'replaced'
+
+
+def test_missing_user_falls_back_to_unknown(tmp_path, monkeypatch, signer):
+    def no_user():
+        raise KeyError('getpwuid(): uid not found')
+    monkeypatch.setattr(getpass, 'getuser', no_user)
+    rsa_key_path = str(tmp_path / 'adbkey')
+    os.remove(rsa_key_path + '.pub')
+    sign_cryptography._keys_cache.clear()
+    public_key = CryptographySigner(rsa_key_path).get_public_key()
+    assert public_key.split(b' ', 1)[1].startswith(b'unknown@')
+
+
+def test_generate_on_missing_key(tmp_path):
+    rsa_key_path = str(tmp_path / 'keys' / 'adbkey')
+    signer = CryptographySigner(rsa_key_path, generate=True)
+    assert os.path.exists(rsa_key_path + '.pub')
+    assert CryptographySigner(rsa_key_path).rsa_key is signer.rsa_key